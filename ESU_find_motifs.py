@@ -3,11 +3,47 @@
 
 from __future__ import division, print_function
 
+from functools import lru_cache
+from itertools import chain, groupby, permutations, product
 from operator import itemgetter
 import random
 
 import networkx as nx
 import networkx.algorithms.isomorphism as iso
+import numpy as np
+
+try:
+    import joblib
+except ImportError:  # Randomized networks can only be processed serially
+    joblib = None
+
+try:
+    import numba
+except ImportError:  # Pure Python alternatives are used instead
+    numba = None
+
+try:
+    import pynauty
+except ImportError:  # Canonical labels are computed by brute force instead
+    pynauty = None
+
+# Subgraphs returned at once by the compiled ESU
+_SUBGRAPHS_PER_BATCH = 1024
+
+# Without pynauty, larger graphs are labelled with VF2 instead of trying the
+# node permutations
+_MAX_PERMUTED_SIZE = 7
+
+# Graphs labelled with VF2, as lists of one representative per topology in
+# buckets by number of nodes and edges
+_isomorphism_classes = {}
+
+
+def _njit(func):
+    """Private decorator compiling `func` with numba, if available."""
+    if numba is None:
+        return func
+    return numba.njit(cache=True, nogil=True)(func)
 
 
 def find_pattern(graph, pattern, sign_sensitive=False):
@@ -23,11 +59,7 @@ def find_pattern(graph, pattern, sign_sensitive=False):
     Based on the code from
     https://zulko.wordpress.com/2012/10/13/finding-a-subnetwork-with-a-given-topology-in-e-coli/
     """
-    edge_match = None
-    if sign_sensitive:
-        def edge_match(e1, e2):
-            return (e1["sign"] == e2["sign"])
-
+    edge_match = _sign_edge_match if sign_sensitive else None
     if graph.is_directed() and pattern.is_directed():
         matcher = iso.DiGraphMatcher(graph, pattern, edge_match=edge_match)
     elif not graph.is_directed() and not pattern.is_directed():
@@ -39,7 +71,13 @@ def find_pattern(graph, pattern, sign_sensitive=False):
     return matcher.subgraph_isomorphisms_iter()
 
 
-def enumerate_subgraphs(graph, seed_nodes=None, size=3):
+def _sign_edge_match(e1, e2, _get_sign=itemgetter("sign")):
+    """Private method to check if two edges have the same sign."""
+    return _get_sign(e1) == _get_sign(e2)
+
+
+def enumerate_subgraphs(graph, seed_nodes=None, size=3, probabilities=None,
+                        prng=None):
     """Find all connected subgraphs of the given size.
 
     Return an iterator over all the connected subgraphs of the specified
@@ -47,6 +85,15 @@ def enumerate_subgraphs(graph, seed_nodes=None, size=3):
     those nodes. Note that if the `seed_nodes` are not connected between them,
     disconnected subgraphs may be returned.
 
+    If `probabilities` is not None, only a random sample of the subgraphs is
+    returned, using the RAND-ESU variant: it must have one probability in
+    (0, 1] for each of the `size` levels of the ESU tree, and each node of a
+    level is explored with that probability. Each subgraph is then returned
+    with probability equal to the product of them. The seed nodes fill the
+    first levels, so with `seed_nodes` only the probabilities of the
+    remaining levels are used and multiplied. The random numbers are taken
+    from `prng` or, if not provided, from the `random` module.
+
     It uses the algorithm EnumerateSUbgraphs or ESU used by FANMOD and
     described in:
     S. Wernicke, "Efficient Detection of Network Motifs," IEEE/ACM Transactions
@@ -56,34 +103,298 @@ def enumerate_subgraphs(graph, seed_nodes=None, size=3):
         seed_nodes = []
 
     # Change the node names for numerical labels (required by ESU)
-    node_mapping = dict(zip(graph.nodes(), range(graph.number_of_nodes())))
-    graph = nx.relabel_nodes(graph, node_mapping, copy=True)
+    nodes, edges = _edge_array(graph)
+    node_mapping = dict(zip(nodes, range(len(nodes))))
     seed_nodes = [node_mapping[n] for n in seed_nodes]
-
-    # Use a recurrent function to get each subgraph and change the names back
-    rev_node_mapping = {v: k for k, v in node_mapping.iteritems()}
     del node_mapping
-    for subgraph in _enumerate_subgraphs(graph, seed_nodes=seed_nodes,
-                                         size=size):
-        yield [rev_node_mapping[n] for n in subgraph]
 
+    # Enumerate the subgraphs and change the names back
+    for subgraph in _enumerate_subgraphs_int(edges, len(nodes),
+                                             seed_nodes=seed_nodes, size=size,
+                                             probabilities=probabilities,
+                                             prng=prng):
+        yield [nodes[n] for n in subgraph]
+
+
+def _enumerate_subgraphs_int(edges, order, seed_nodes, size,
+                             probabilities=None, prng=None):
+    """Private method to Enumerate SUbgraphs of a graph with nodes 0 to n-1.
+
+    The graph is given by its `order` and the (m, 2) array of `edges` with
+    node indices.
+    """
+    indptr, indices = _neighbors_csr(edges, order)
+    return _enumerate_subgraphs(indptr, indices, seed_nodes=seed_nodes,
+                                size=size, probabilities=probabilities,
+                                prng=prng)
+
+
+def _neighbors_csr(edges, order):
+    """Private method to get the neighbors of each node in CSR format.
+
+    Nodes are given by index, from 0 to `order`-1, and `edges` is an (m, 2)
+    array of them. Return two int32 arrays `indptr` and `indices` such that
+    the sorted (in or out) neighbors of node `n` are
+    `indices[indptr[n]:indptr[n+1]]`. Selfloops are not included.
+    """
+    # Sorting both orientations of each edge groups the neighbors by node
+    pairs = np.concatenate((edges, edges[:, ::-1]))
+    pairs = np.unique(pairs[pairs[:, 0] != pairs[:, 1]], axis=0)
+    indptr = np.zeros(order+1, dtype=np.int32)
+    np.cumsum(np.bincount(pairs[:, 0], minlength=order), out=indptr[1:])
+    indices = np.ascontiguousarray(pairs[:, 1], dtype=np.int32)
+    return indptr, indices
+
+
+def _enumerate_subgraphs(indptr, indices, seed_nodes, size,
+                         probabilities=None, prng=None):
+    """Private method to Enumerate SUbgraphs, in batches with numba."""
+    sampling = probabilities is not None
+    if sampling:
+        _check_probabilities(probabilities, size)
+    else:
+        probabilities = [1.0] * size
+    prng = prng or random.Random()
 
-def _enumerate_subgraphs(graph, seed_nodes, size):
-    """Private method to Enumerate SUbgraphs using a recursive approach."""
-    if len(seed_nodes) == size:
-        yield seed_nodes
+    if len(seed_nodes) >= size:
+        if len(seed_nodes) == size:
+            yield seed_nodes
+        return
+    if numba is None:
+        for subgraph in _esu_lists(indptr, indices, seed_nodes, size,
+                                   probabilities, prng):
+            yield subgraph
+        return
+
+    probabilities = np.array(probabilities, dtype=np.float64)
+    seed_nodes = np.array(seed_nodes, dtype=np.int32)
+    order = len(indptr) - 1
+    # The work arrays are shared by all the batches, and `state` keeps
+    # where the enumeration stopped so that the next batch resumes there
+    state = np.zeros(5, dtype=np.int64)
+    if sampling:
+        state[4] = prng.randrange(2**32)
+    blocked = np.zeros(order, dtype=np.int32)
+    subgraph = np.empty(size, dtype=np.int32)
+    extension = np.empty((size, order), dtype=np.int32)
+    ext_len = np.zeros(size, dtype=np.int32)
+    ext_pos = np.zeros(size, dtype=np.int32)
+    subgraphs = np.empty((_SUBGRAPHS_PER_BATCH, size), dtype=np.int32)
+    while True:
+        count = _esu(indptr, indices, seed_nodes, size, probabilities, state,
+                     blocked, subgraph, extension, ext_len, ext_pos,
+                     subgraphs)
+        for row in subgraphs[:count].tolist():
+            yield row
+        if count < len(subgraphs):
+            return
+
+
+def _check_probabilities(probabilities, size):
+    """Private method to validate the RAND-ESU probabilities of each level."""
+    if len(probabilities) != size:
+        raise ValueError("there must be one probability for each node of "
+                         "the subgraphs")
+    if not all(0 < p <= 1 for p in probabilities):
+        raise ValueError("probabilities must be in the interval (0, 1]")
+
+
+def _esu_lists(indptr, indices, seed_nodes, size, probabilities, prng):
+    """Private method to run ESU using Python lists of nodes.
+
+    It is the alternative to `_esu` when numba is not available. Each step
+    costs time proportional to the degree of the new node, not to the order
+    of the graph as with bitsets of nodes. It follows `_esu`, marking in
+    `blocked` the position plus one of the node that blocked each node, and
+    keeping a stack with the extension of each subgraph and the position of
+    the next node to take from it.
+    """
+    bounds = indptr.tolist()
+    indices = indices.tolist()
+    neighbors = [indices[bounds[node]:bounds[node+1]]
+                 for node in range(len(bounds) - 1)]
+    blocked = [0] * len(neighbors)
+
+    if seed_nodes:
+        roots = [(seed_nodes, -1)]
     else:
-        if len(seed_nodes) == 0:
-            neighbors = xrange(graph.order())
-        else:
-            max_node = max(seed_nodes)
-            neighbors = (ngbr for n in seed_nodes
-                         for ngbr in graph.predecessors(n)+graph.successors(n)
-                         if max_node < ngbr and ngbr not in seed_nodes)
+        roots = (([node], node) for node in range(len(neighbors)))
+    for nodes, min_node in roots:
+        if (not seed_nodes and probabilities[0] < 1.0 and
+                prng.random() >= probabilities[0]):
+            continue
+        n_seeds = len(nodes)
+        if n_seeds == size:
+            yield list(nodes)
+            continue
+        # The seed nodes block all their neighbors at once
+        extension = []
+        for node in nodes:
+            blocked[node] = n_seeds
+        for node in nodes:
+            for ngbr in neighbors[node]:
+                if not blocked[ngbr]:
+                    blocked[ngbr] = n_seeds
+                    if ngbr > min_node:
+                        extension.append(ngbr)
+        subgraph = list(nodes)
+        stack = [[extension, 0]]
+        while stack:
+            frame = stack[-1]
+            extension, pos = frame
+            depth = len(subgraph)
+            if pos == len(extension):
+                # Go back to the parent subgraph, unblocking the last node
+                stack.pop()
+                if depth > n_seeds:
+                    for ngbr in neighbors[subgraph.pop()]:
+                        if blocked[ngbr] == depth:
+                            blocked[ngbr] = 0
+                continue
+            frame[1] = pos + 1
+            if (probabilities[depth] < 1.0 and
+                    prng.random() >= probabilities[depth]):
+                continue
+            node = extension[pos]
+            if depth + 1 == size:
+                yield subgraph + [node]
+                continue
+            extension = extension[pos+1:]
+            for ngbr in neighbors[node]:
+                if not blocked[ngbr]:
+                    blocked[ngbr] = depth + 1
+                    if ngbr > min_node:
+                        extension.append(ngbr)
+            subgraph.append(node)
+            stack.append([extension, 0])
+
+        # Leave `blocked` clean for the next root
+        for node in nodes:
+            blocked[node] = 0
+            for ngbr in neighbors[node]:
+                if blocked[ngbr] == n_seeds:
+                    blocked[ngbr] = 0
+
+
+@_njit
+def _esu(indptr, indices, seed_nodes, size, probabilities, state, blocked,
+         subgraph, extension, ext_len, ext_pos, subgraphs):
+    """Private method to run ESU until `subgraphs` is full.
+
+    If `seed_nodes` is not empty, only the subgraphs extending them are
+    enumerated, otherwise those of every root node. The node added at
+    position `d` is explored with probability `probabilities[d]`. This is
+    the iterative version of ExtendSubgraph, where `extension[d]` holds the
+    extension set of the subgraph with `d` nodes. A node is blocked (it is in
+    the subgraph or one of its neighbors) by the first node of the subgraph
+    that reached it, and `blocked` stores the position of that node plus one.
+
+    `state` holds the next root node, the size of the subgraph being
+    extended (0 between roots), the number of seed nodes, the minimum node
+    and the seed of the numpy generator, and it is updated so that the next
+    call resumes the enumeration. The generator is seeded again on each
+    call, as other compiled code may have seeded it in between. Return the
+    number of rows filled, fewer than the rows of `subgraphs` once the
+    enumeration is over.
+    """
+    np.random.seed(state[4])
+    order = len(indptr) - 1
+    count = 0
+    while count < len(subgraphs):
+        depth = state[1]
+        if depth == 0:
+            # Start from the seed nodes or from the next root node
+            if len(seed_nodes):
+                if state[0] > 0:
+                    break
+                n_seeds = len(seed_nodes)
+                min_node = -1
+                subgraph[:n_seeds] = seed_nodes
+            else:
+                if state[0] == order:
+                    break
+                n_seeds = 1
+                min_node = state[0]
+                subgraph[0] = min_node
+            state[0] += 1
+            if (not len(seed_nodes) and probabilities[0] < 1.0 and
+                    np.random.random() >= probabilities[0]):
+                continue
+            if n_seeds == size:
+                subgraphs[count] = subgraph
+                count += 1
+                continue
 
-        for ngbr in neighbors:
-            for result in _enumerate_subgraphs(graph, seed_nodes+[ngbr], size):
-                yield result
+            # The seed nodes block all their neighbors at once
+            n_ext = 0
+            for i in range(n_seeds):
+                blocked[subgraph[i]] = n_seeds
+            for i in range(n_seeds):
+                for j in range(indptr[subgraph[i]], indptr[subgraph[i]+1]):
+                    ngbr = indices[j]
+                    if blocked[ngbr] == 0:
+                        blocked[ngbr] = n_seeds
+                        if ngbr > min_node:
+                            extension[n_seeds, n_ext] = ngbr
+                            n_ext += 1
+            ext_len[n_seeds] = n_ext
+            ext_pos[n_seeds] = 0
+            state[1] = n_seeds
+            state[2] = n_seeds
+            state[3] = min_node
+            continue
+
+        n_seeds = state[2]
+        min_node = state[3]
+        if ext_pos[depth] == ext_len[depth]:
+            if depth == n_seeds:
+                # Leave `blocked` clean for the next root
+                for i in range(n_seeds):
+                    blocked[subgraph[i]] = 0
+                    for j in range(indptr[subgraph[i]],
+                                   indptr[subgraph[i]+1]):
+                        if blocked[indices[j]] == n_seeds:
+                            blocked[indices[j]] = 0
+                state[1] = 0
+                continue
+            # Go back to the parent subgraph, unblocking the last node
+            depth -= 1
+            node = subgraph[depth]
+            for j in range(indptr[node], indptr[node+1]):
+                if blocked[indices[j]] == depth + 1:
+                    blocked[indices[j]] = 0
+            state[1] = depth
+            continue
+
+        node = extension[depth, ext_pos[depth]]
+        ext_pos[depth] += 1
+        if (probabilities[depth] < 1.0 and
+                np.random.random() >= probabilities[depth]):
+            continue
+        subgraph[depth] = node
+        if depth + 1 == size:
+            subgraphs[count] = subgraph
+            count += 1
+            continue
+
+        # The new extension keeps the remaining nodes of the current one and
+        # adds the exclusive neighbors of the new node
+        n_ext = 0
+        for j in range(ext_pos[depth], ext_len[depth]):
+            extension[depth+1, n_ext] = extension[depth, j]
+            n_ext += 1
+        for j in range(indptr[node], indptr[node+1]):
+            ngbr = indices[j]
+            if blocked[ngbr] == 0:
+                blocked[ngbr] = depth + 1
+                if ngbr > min_node:
+                    extension[depth+1, n_ext] = ngbr
+                    n_ext += 1
+        ext_len[depth+1] = n_ext
+        ext_pos[depth+1] = 0
+        state[1] = depth + 1
+    state[4] = np.random.randint(0, 2**32)
+    return count
 
 
 def count_unique_topologies(topologies):
@@ -93,16 +404,112 @@ def count_unique_topologies(topologies):
     isomorphic topology found, with the graph object as the first element and
     the number of found instances as the second.
     """
-    unique_topologies = []
+    _clear_isomorphism_classes()
+    return list(_count_topologies(topologies).values())
+
+
+def _count_topologies(topologies):
+    """Private method to count topologies indexed by their canonical label."""
+    buckets = {}
     for topo in topologies:
-        for i in range(len(unique_topologies)):
-            if nx.is_isomorphic(unique_topologies[i][0], topo):
-                unique_topologies[i][1] += 1
-                break
-        else:
-            unique_topologies.append([topo, 1])
+        buckets.setdefault(_canonical_label(topo), [topo, 0])[1] += 1
+
+    return buckets
 
-    return unique_topologies
+
+def _canonical_label(graph):
+    """Private method to get a certificate of the topology of a graph.
+
+    Two graphs get the same certificate if and only if they are isomorphic.
+    The certificate packs the bits of the adjacency matrix of the graph, with
+    the nodes sorted in canonical order (see `_edges_label`).
+    """
+    nodes = list(graph.nodes())
+    size = len(nodes)
+    index = dict(zip(nodes, range(size)))
+    edges = set((index[s], index[t]) for s, t in graph.edges())
+    if not graph.is_directed():
+        edges.update([(t, s) for s, t in edges])
+
+    return _edges_label(size, tuple(sorted(edges)), graph.is_directed())
+
+
+@lru_cache(maxsize=1 << 16)
+def _edges_label(size, edges, directed):
+    """Private method to get the certificate of a graph given by its edges.
+
+    The graph has nodes 0 to `size`-1 and the sorted tuple of `edges` (both
+    orientations for undirected graphs). Results are cached, as the same
+    subgraphs appear many times in a network. If `pynauty` is installed it is
+    used to find the canonical order of the nodes, otherwise all the
+    permutations of nodes with the same degrees are tried, which is only
+    feasible for small graphs such as motifs. Larger graphs are labelled with
+    `_isomorphism_class`.
+    """
+    if pynauty is not None and size > 0:
+        # Selfloops are given to nauty as a vertex coloring
+        adjacency = {i: [] for i in range(size)}
+        for s, t in edges:
+            if s != t:
+                adjacency[s].append(t)
+        selfloops = set(s for s, t in edges if s == t)
+        pynauty_graph = pynauty.Graph(size, directed=directed,
+                                      adjacency_dict=adjacency,
+                                      vertex_coloring=[selfloops]
+                                      if selfloops else [])
+        label = _adjacency_bits(edges, pynauty.canon_label(pynauty_graph))
+    elif size > _MAX_PERMUTED_SIZE:
+        label = _isomorphism_class(size, edges, directed)
+    else:
+        # Isomorphisms preserve degrees, so only the permutations of nodes
+        # with the same in and out degrees have to be tried
+        degrees = [(0, 0)] * size
+        for s, t in edges:
+            degrees[s] = (degrees[s][0], degrees[s][1] + 1)
+            degrees[t] = (degrees[t][0] + 1, degrees[t][1])
+        by_degree = sorted(range(size), key=degrees.__getitem__)
+        classes = [list(nodes) for _, nodes in groupby(by_degree,
+                                                       degrees.__getitem__)]
+        label = min(_adjacency_bits(edges, chain.from_iterable(arrangement))
+                    for arrangement in product(*[permutations(nodes)
+                                                 for nodes in classes]))
+
+    return size, label
+
+
+def _isomorphism_class(size, edges, directed):
+    """Private method to label a graph by its topology using VF2.
+
+    Topologies are bucketed by their number of nodes and edges, so that VF2
+    only compares graphs of the same bucket. Return the number of edges and
+    the position of the topology in its bucket, adding it if it is new.
+    Labels thus depend on the order in which graphs are labelled, and are
+    only valid within the running process until the next call to
+    `_clear_isomorphism_classes`.
+    """
+    graph = nx.DiGraph() if directed else nx.Graph()
+    graph.add_nodes_from(range(size))
+    graph.add_edges_from(edges)
+    bucket = _isomorphism_classes.setdefault((size, len(edges), directed), [])
+    for i, topo in enumerate(bucket):
+        if nx.is_isomorphic(topo, graph):
+            return len(edges), i
+    bucket.append(graph)
+    return len(edges), len(bucket) - 1
+
+
+def _clear_isomorphism_classes():
+    """Private method to forget the topologies labelled with VF2."""
+    if _isomorphism_classes:
+        _isomorphism_classes.clear()
+        _edges_label.cache_clear()
+
+
+def _adjacency_bits(edges, order):
+    """Private method to pack an adjacency matrix with nodes in given order."""
+    position = {node: i for i, node in enumerate(order)}
+    size = len(position)
+    return sum(1 << (position[s]*size + position[t]) for s, t in edges)
 
 
 def randomize_graph(graph, swap_steps=None, prng=None, maxsteps=None):
@@ -111,7 +518,7 @@ def randomize_graph(graph, swap_steps=None, prng=None, maxsteps=None):
     Return a randomized copy a graph by crossing pairs of edges. It randomly
     selects two edges, removes them, and connects the source nodes of the first
     and second edges with the target nodes of the second and first edge,
-    respectively.
+    respectively. Node and graph attributes are kept, but not edge attributes.
 
     Parameters
     ----------
@@ -128,24 +535,194 @@ def randomize_graph(graph, swap_steps=None, prng=None, maxsteps=None):
     cellular networks of transcription–regulation and protein–protein
     interaction." Proc. Natl. Acad. Sci. USA, 2004. doi:10.1073/pnas.0306752101
     """
-    graph = graph.copy()
-    prng = prng or random.Random()
-    swap_steps = swap_steps or graph.number_of_edges()*3
-    maxsteps = maxsteps or swap_steps * 10
+    # Swap the edges as rows of an array of node indices
+    nodes, edges = _edge_array(graph)
+    _randomize_edges(edges, prng or random.Random(), swap_steps, maxsteps,
+                     graph.is_directed())
 
+    rgraph = graph.__class__()
+    rgraph.graph.update(graph.graph)
+    rgraph.add_nodes_from(graph.nodes(data=True))
+    rgraph.add_edges_from((nodes[s], nodes[t]) for s, t in edges.tolist())
+    return rgraph
+
+
+def _edge_array(graph):
+    """Private method to get the edges of `graph` as node indices.
+
+    Return the list of nodes and an (m, 2) int32 array with the position in
+    that list of the source and target nodes of each edge.
+    """
+    nodes = list(graph.nodes())
+    index = dict(zip(nodes, range(len(nodes))))
+    edges = np.array([(index[s], index[t]) for s, t in graph.edges()],
+                     dtype=np.int32).reshape(-1, 2)
+    return nodes, edges
+
+
+def _randomize_edges(edges, prng, swap_steps, maxsteps, directed):
+    """Private method to cross pairs of edges of an (m, 2) array in place.
+
+    A set with the current edges is kept aside to check if the new ones
+    already exist. For undirected graphs it holds both orientations of each
+    edge. If numba is available the compiled `_swap_edges` is used instead.
+    The default swap and trial steps are those of `randomize_graph`.
+    """
+    swap_steps = swap_steps or len(edges)*3
+    maxsteps = maxsteps or swap_steps * 10
+    if swap_steps and len(edges) < 2:
+        raise ValueError("at least two edges are needed to swap them")
+    if numba is not None:
+        _swap_edges(edges, swap_steps, maxsteps, directed,
+                    prng.randrange(2**32))
+        return
+
+    # Swap a list of edges, writing them back into the array at the end
+    edge_list = list(map(tuple, edges.tolist()))
+    edge_set = set(edge_list)
+    if not directed:
+        edge_set.update([(t, s) for s, t in edge_set])
+
+    n_edges = len(edge_list)
     step = swaps = 0
     while swaps < swap_steps:
         step += 1
         if step > maxsteps:
             raise RuntimeError("Reached max number of steps in the "
                                "randomization process.")
-        (s1, t1), (s2, t2) = prng.sample(graph.edges(), 2)
-        if not graph.has_edge(s1, t2) and not graph.has_edge(s2, t1):
+        # Two different edges, shifting the second one past the first
+        i, j = prng.randrange(n_edges), prng.randrange(n_edges - 1)
+        j += j >= i
+        (s1, t1), (s2, t2) = edge_list[i], edge_list[j]
+        # Two undirected self-loops would be crossed into a single edge
+        if not directed and s1 == t1 and s2 == t2:
+            continue
+        if (s1, t2) not in edge_set and (s2, t1) not in edge_set:
             swaps += 1
-            graph.add_edges_from(((s1, t2), (s2, t1)))
-            graph.remove_edges_from(((s1, t1), (s2, t2)))
+            edge_list[i] = s1, t2
+            edge_list[j] = s2, t1
+            old_edges, new_edges = ((s1, t1), (s2, t2)), ((s1, t2), (s2, t1))
+            if not directed:
+                old_edges += ((t1, s1), (t2, s2))
+                new_edges += ((t2, s1), (t1, s2))
+            edge_set.difference_update(old_edges)
+            edge_set.update(new_edges)
+    edges[:] = np.array(edge_list, dtype=np.int32).reshape(-1, 2)
+
+
+@_njit
+def _swap_edges(edges, swap_steps, maxsteps, directed, seed):
+    """Private method to cross pairs of edges of an (m, 2) array in place.
+
+    Compiled version of `_randomize_edges`, drawing the edges with the numpy
+    generator seeded with `seed`. The edge set is an open addressing hash
+    table of the edges packed as uint64 (see `_edge_key`).
+    """
+    np.random.seed(seed)
+    n_edges = len(edges)
+    capacity = 2
+    while capacity < 4*n_edges:
+        capacity *= 2
+    table = np.zeros(capacity, dtype=np.uint64)
+    for i in range(n_edges):
+        _insert_key(table, _edge_key(edges[i, 0], edges[i, 1]))
+        if not directed:
+            _insert_key(table, _edge_key(edges[i, 1], edges[i, 0]))
+
+    step = swaps = 0
+    while swaps < swap_steps:
+        step += 1
+        if step > maxsteps:
+            raise RuntimeError("Reached max number of steps in the "
+                               "randomization process.")
+        i = np.random.randint(0, n_edges)
+        j = np.random.randint(0, n_edges - 1)
+        if j >= i:
+            j += 1
+        s1, t1, s2, t2 = edges[i, 0], edges[i, 1], edges[j, 0], edges[j, 1]
+        if not directed and s1 == t1 and s2 == t2:
+            continue
+        if (_has_key(table, _edge_key(s1, t2)) or
+                _has_key(table, _edge_key(s2, t1))):
+            continue
+        swaps += 1
+        edges[i, 1] = t2
+        edges[j, 1] = t1
+        _erase_key(table, _edge_key(s1, t1))
+        _erase_key(table, _edge_key(s2, t2))
+        _insert_key(table, _edge_key(s1, t2))
+        _insert_key(table, _edge_key(s2, t1))
+        if not directed:
+            _erase_key(table, _edge_key(t1, s1))
+            _erase_key(table, _edge_key(t2, s2))
+            _insert_key(table, _edge_key(t2, s1))
+            _insert_key(table, _edge_key(t1, s2))
+
+
+@_njit
+def _edge_key(source, target):
+    """Private method to pack an edge into a (non zero) uint64 key."""
+    return ((np.uint64(source) << np.uint64(32)) | np.uint64(target)) + \
+        np.uint64(1)
+
+
+@_njit
+def _key_slot(table, key):
+    """Private method to get the slot of the table where `key` should be.
+
+    It is either the slot holding the key or the empty slot (with 0) where
+    the linear probing for that key stops.
+    """
+    mask = len(table) - 1
+    slot = _key_home(key, mask)
+    while table[slot] != 0 and table[slot] != key:
+        slot = (slot + 1) & mask
+    return slot
+
+
+@_njit
+def _key_home(key, mask):
+    """Private method to get the first slot probed for `key` (its hash)."""
+    mixed = key * np.uint64(0x9E3779B97F4A7C15)
+    return np.int64((mixed >> np.uint64(32)) & np.uint64(mask))
+
+
+@_njit
+def _has_key(table, key):
+    """Private method to check if the hash table contains `key`."""
+    return table[_key_slot(table, key)] == key
+
 
-    return graph
+@_njit
+def _insert_key(table, key):
+    """Private method to add `key` to the hash table if it is not there."""
+    table[_key_slot(table, key)] = key
+
+
+@_njit
+def _erase_key(table, key):
+    """Private method to remove `key` from the hash table, if it is there.
+
+    The following keys in the same run of slots are shifted back when needed
+    so that linear probing for them still works without tombstones.
+    """
+    mask = len(table) - 1
+    empty = _key_slot(table, key)
+    if table[empty] == 0:
+        return
+    slot = empty
+    while True:
+        slot = (slot + 1) & mask
+        if table[slot] == 0:
+            break
+        home = _key_home(table[slot], mask)
+        # The key stays if its home slot is cyclically in (empty, slot]
+        if (empty < slot and empty < home <= slot) or \
+                (empty > slot and (home > empty or home <= slot)):
+            continue
+        table[empty] = table[slot]
+        empty = slot
+    table[empty] = 0
 
 
 def find_motifs_slow(graph, size=3, min_occurrences=5,  rand_networks=1000,
@@ -202,7 +779,7 @@ def find_motifs_slow(graph, size=3, min_occurrences=5,  rand_networks=1000,
 
 
 def find_motifs(graph, size=3, min_occurrences=5,  rand_networks=1000,
-                ping_every=0, prng=None):
+                ping_every=0, prng=None, n_jobs=1, probabilities=None):
     u"""Count all motifs of a given size and its statistical relevance.
 
     Identify all motifs of a given size in a network asses if they are enriched
@@ -231,29 +808,120 @@ def find_motifs(graph, size=3, min_occurrences=5,  rand_networks=1000,
     ping_every : int, optional (default=0)
         Print the number of randomized networks processed every `ping_every`
         networks. If equal to 0 or False nothing is printed.
+    n_jobs : int, optional (default=1)
+        Number of processes used to analyse the randomized networks, with the
+        same meaning as in `joblib.Parallel` (-1 means as many as CPUs). Any
+        value other than 1 requires `joblib`.
+    probabilities : list of float, optional
+        If given, subgraphs are sampled with RAND-ESU instead of fully
+        enumerated (see `enumerate_subgraphs`), and the number of occurrences
+        of each motif is estimated from the sample. `min_occurrences` is then
+        compared with the estimated number.
     """
-    all_subgraphs_iter = enumerate_subgraphs(graph, size=size)
-    motifs = count_unique_topologies((graph.subgraph(sub)
-                                      for sub in all_subgraphs_iter))
-    motifs = [[topo, n, 0] for topo, n in motifs if n >= min_occurrences]
-
-    # Count how many times we find the same motifs in random networks
-    for i in range(rand_networks):
+    # Sampled counts are scaled by the probability of sampling each subgraph
+    scale = 1
+    if probabilities is not None:
+        _check_probabilities(probabilities, size)
+        scale = 1 / float(np.prod(probabilities))
+
+    # Subgraphs are handled as node indices, and only one graph object is
+    # built for each motif
+    _clear_isomorphism_classes()
+    prng = prng or random.Random()
+    nodes, edges = _edge_array(graph)
+    order, directed = len(nodes), graph.is_directed()
+    motifs = [[graph.subgraph([nodes[i] for i in sub]), sub_edges, n, 0]
+              for sub, sub_edges, n in _count_subgraphs(
+                  edges, order, directed, size, probabilities, prng).values()
+              if n * scale >= min_occurrences]
+
+    # Count how many times we find the same motifs in random networks. They
+    # are randomized as arrays of node indices, and each one gets its own
+    # seed, so results do not depend on `n_jobs`. Motifs are given by their
+    # edges, as VF2 labels would not match in other processes
+    seeds = [prng.randrange(2**32) for i in range(rand_networks)]
+    counts = [(sub_edges, n) for topo, sub_edges, n, m in motifs]
+    if n_jobs == 1:
+        rand_hits = (_rand_motif_hits(edges, order, directed, size,
+                                      probabilities, counts, seed)
+                     for seed in seeds)
+    elif joblib is None:
+        raise ImportError("joblib is required to use n_jobs != 1")
+    else:
+        parallel = joblib.Parallel(n_jobs=n_jobs, return_as="generator")
+        rand_hits = parallel(joblib.delayed(_rand_motif_hits)(
+            edges, order, directed, size, probabilities, counts, seed)
+            for seed in seeds)
+    for i, hits in enumerate(rand_hits):
         if ping_every and i % ping_every == 0:
             print(i, end=" ")
 
-        rgraph = randomize_graph(graph, prng=prng)
-        rand_subgraphs_iter = enumerate_subgraphs(rgraph, size=size)
-        rand_motifs = count_unique_topologies((rgraph.subgraph(sub)
-                                               for sub in rand_subgraphs_iter))
-        for rmotif, rn in rand_motifs:
-            if rn < min_occurrences:
-                continue
-            for i in range(len(motifs)):
-                if rn >= motifs[i][1] and nx.is_isomorphic(motifs[i][0],
-                                                           rmotif):
-                    motifs[i][2] += 1
+        for motif in hits:
+            motifs[motif][3] += 1
     if ping_every:
         print()  # Line break in the output
-    return sorted([(topo, n, float(m)/rand_networks) for topo, n, m in motifs],
-                  key=itemgetter(2))
+    return sorted([(topo, n * scale, float(m)/rand_networks)
+                   for topo, sub_edges, n, m in motifs], key=itemgetter(2))
+
+
+def _rand_motif_hits(edges, order, directed, size, probabilities, counts,
+                     seed):
+    """Private method to find the motifs enriched in a randomized network.
+
+    The network is given as in `_count_subgraphs`, and `edges` is not
+    modified. `counts` lists the edges of each motif (as in `_edges_label`)
+    and its number of occurrences. Return the positions in `counts` of the
+    motifs that appear at least that number of times in the randomized
+    network.
+    """
+    prng = random.Random(seed)
+    edges = edges.copy()
+    _randomize_edges(edges, prng, None, None, directed)
+    rand_counts = _count_subgraphs(edges, order, directed, size,
+                                   probabilities, prng)
+    hits = []
+    for i, (sub_edges, n) in enumerate(counts):
+        label = _edges_label(size, sub_edges, directed)
+        if label in rand_counts and rand_counts[label][2] >= n:
+            hits.append(i)
+    return hits
+
+
+def _count_subgraphs(edges, order, directed, size, probabilities, prng):
+    """Private method to count the subgraphs of each topology in a network.
+
+    The network is given by its `order` and the (m, 2) array of `edges` with
+    node indices. Subgraphs are sampled as in `enumerate_subgraphs` if
+    `probabilities` is not None. Return a dictionary with a list for each
+    canonical label, holding the first subgraph found (as node indices), its
+    edges (see `_subgraph_edges`) and the number of subgraphs with that
+    topology.
+    """
+    successors = [set() for n in range(order)]
+    for source, target in edges.tolist():
+        successors[source].add(target)
+        if not directed:
+            successors[target].add(source)
+
+    counts = {}
+    for sub in _enumerate_subgraphs_int(edges, order, seed_nodes=[],
+                                        size=size,
+                                        probabilities=probabilities,
+                                        prng=prng):
+        sub_edges = _subgraph_edges(sub, successors)
+        label = _edges_label(size, sub_edges, directed)
+        counts.setdefault(label, [sub, sub_edges, 0])[2] += 1
+    return counts
+
+
+def _subgraph_edges(subgraph, successors):
+    """Private method to get the edges of an induced subgraph.
+
+    The edges are read straight from the set of `successors` of each node
+    (both orientations for undirected graphs), given by node index. Return
+    them as positions in `subgraph`, in the sorted tuple that `_edges_label`
+    takes.
+    """
+    return tuple((i, j) for i, source in enumerate(subgraph)
+                 for j, target in enumerate(subgraph)
+                 if target in successors[source])
@@ -2,12 +2,15 @@
 # -*- coding: utf-8 -*-
 """Test suite for the BruteForce module."""
 
+import itertools as it
 import unittest as ut
+from unittest import mock
 import random
 
 import networkx as nx
 
 from pyMotifFinder import *
+from pyMotifFinder import ESU_find_motifs
 
 class EnumerateSubgraphsTests(ut.TestCase):
     def setUp(self):
@@ -21,11 +24,109 @@ class EnumerateSubgraphsTests(ut.TestCase):
                          [[0, 1, 2, 3], [0, 1, 2, 4], [0, 1, 2, 5],
                           [0, 1, 2, 6], [0, 1, 3, 4], [0, 2, 5, 6]])
 
+    def test_each_subgraph_once(self):
+        graph = nx.gnp_random_graph(12, 0.25, seed=1, directed=True)
+        for size in (3, 4):
+            subgraphs = [tuple(sorted(sub))
+                         for sub in enumerate_subgraphs(graph, size=size)]
+            connected = [sub for sub in it.combinations(graph, size)
+                         if nx.is_weakly_connected(graph.subgraph(sub))]
+            self.assertEqual(len(subgraphs), len(set(subgraphs)))
+            self.assertEqual(sorted(subgraphs), sorted(connected))
+
+    def test_sampled_tree_graph(self):
+        prng = random.Random(1)
+        self.assertEqual(list(enumerate_subgraphs(self.tree_graph, size=3,
+                                                  probabilities=(1, 1, 1),
+                                                  prng=prng)),
+                         list(enumerate_subgraphs(self.tree_graph, size=3)))
+        sample = list(enumerate_subgraphs(self.tree_graph, size=3,
+                                          probabilities=(1, 1, 0.5),
+                                          prng=prng))
+        for subgraph in sample:
+            self.assertIn(subgraph,
+                          list(enumerate_subgraphs(self.tree_graph, size=3)))
+        for probabilities in ((1, 0.5), (1, 0, 1), (1, 1.5, 1)):
+            with self.assertRaises(ValueError):
+                list(enumerate_subgraphs(self.tree_graph, size=3,
+                                         probabilities=probabilities))
+
+    def test_interleaved_samples(self):
+        graph = nx.gnm_random_graph(60, 300, seed=1, directed=True)
+
+        def sample(seed):
+            return enumerate_subgraphs(graph, size=3,
+                                       probabilities=(1, 1, 0.9),
+                                       prng=random.Random(seed))
+
+        expected = list(sample(1))
+        self.assertGreater(len(expected), 2000)
+        # Other samples and randomizations drawn while one is half consumed
+        # must not change the rest of it
+        subgraphs = sample(1)
+        res = list(it.islice(subgraphs, 1500))
+        list(sample(2))
+        randomize_graph(graph, prng=random.Random(2))
+        res.extend(subgraphs)
+        self.assertEqual(res, expected)
+
     def test_null_subgraoh(self):
         self.assertEqual(list(enumerate_subgraphs(self.tree_graph, size=0)),
                          [[]])
 
 
+@ut.skipIf(ESU_find_motifs.numba is None, "numba is not installed")
+class PythonEnumerateSubgraphsTests(EnumerateSubgraphsTests):
+    """Run the same tests on the enumeration used without numba."""
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(ESU_find_motifs, "numba", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class CountUniqueTopologiesTests(ut.TestCase):
+    def test_isomorphic_topologies(self):
+        chain = nx.DiGraph([(0, 1), (1, 2)])
+        other_chain = nx.DiGraph([("b", "a"), ("c", "b")])
+        fan_out = nx.DiGraph([(0, 1), (0, 2)])
+        res = count_unique_topologies([chain, fan_out, other_chain])
+        self.assertEqual(sorted(n for topo, n in res), [1, 2])
+        for topo, n in res:
+            self.assertTrue(nx.is_isomorphic(topo, chain if n == 2
+                                             else fan_out))
+
+    def test_same_degrees(self):
+        cycle = nx.DiGraph([(0, 1), (1, 2), (2, 3), (3, 0)])
+        two_cycles = nx.DiGraph([(0, 1), (1, 0), (2, 3), (3, 2)])
+        self.assertEqual(len(count_unique_topologies([cycle, two_cycles])),
+                         2)
+
+    def test_large_topologies_without_pynauty(self):
+        cycle = nx.cycle_graph(30, nx.DiGraph())
+        other_cycle = nx.DiGraph()
+        other_cycle.add_nodes_from(random.Random(1).sample(range(30), 30))
+        other_cycle.add_edges_from(cycle.edges())
+        chain = nx.path_graph(30, nx.DiGraph())
+        with mock.patch.object(ESU_find_motifs, "pynauty", None), \
+                mock.patch.dict(ESU_find_motifs._isomorphism_classes,
+                                clear=True), \
+                mock.patch.object(nx, "is_isomorphic",
+                                  wraps=nx.is_isomorphic) as vf2:
+            ESU_find_motifs._edges_label.cache_clear()
+            res = count_unique_topologies([cycle, chain, other_cycle])
+        ESU_find_motifs._edges_label.cache_clear()
+        self.assertEqual(sorted(n for topo, n in res), [1, 2])
+        # The chain has fewer edges, so it is never compared to the cycles
+        self.assertEqual(vf2.call_count, 1)
+
+    def test_selfloops(self):
+        chain = nx.DiGraph([(0, 1), (1, 2)])
+        looped_chain = nx.DiGraph([(0, 1), (1, 2), (2, 2)])
+        self.assertEqual(len(count_unique_topologies([chain, looped_chain])),
+                         2)
+
+
 class RandomizeGraphTests(ut.TestCase):
     def setUp(self):
         self.tree_graph = nx.balanced_tree(2, 2, nx.DiGraph())
@@ -33,8 +134,103 @@ class RandomizeGraphTests(ut.TestCase):
     def test_tree_graph(self):
         res = randomize_graph(self.tree_graph, prng=random.Random(1))
         self.assertFalse(nx.is_isomorphic(self.tree_graph, res))
-        self.assertEqual(self.tree_graph.in_degree(), res.in_degree())
-        self.assertEqual(self.tree_graph.out_degree(), res.out_degree())
+        self.assertEqual(dict(self.tree_graph.in_degree()),
+                         dict(res.in_degree()))
+        self.assertEqual(dict(self.tree_graph.out_degree()),
+                         dict(res.out_degree()))
+
+    def test_many_swaps(self):
+        directed = nx.gnm_random_graph(200, 800, seed=1, directed=True)
+        undirected = nx.gnm_random_graph(200, 800, seed=1)
+        undirected.add_edges_from((n, n) for n in range(0, 200, 10))
+        for graph in (directed, undirected):
+            res = randomize_graph(graph, swap_steps=3000,
+                                  prng=random.Random(1))
+            # Merged duplicates would change the number of edges
+            self.assertEqual(res.number_of_edges(), graph.number_of_edges())
+            self.assertNotEqual(set(res.edges()), set(graph.edges()))
+            if graph.is_directed():
+                self.assertEqual(dict(graph.in_degree()),
+                                 dict(res.in_degree()))
+                self.assertEqual(dict(graph.out_degree()),
+                                 dict(res.out_degree()))
+            else:
+                self.assertEqual(dict(graph.degree()), dict(res.degree()))
+            self.assertEqual(list(res.edges()),
+                             list(randomize_graph(graph, swap_steps=3000,
+                                                  prng=random.Random(1))
+                                  .edges()))
+
+    def test_undirected_selfloops(self):
+        # Crossing the two self-loops would give the same edge twice
+        graph = nx.Graph([(0, 0), (1, 1), (2, 3)])
+        for seed in range(20):
+            res = randomize_graph(graph, swap_steps=1,
+                                  prng=random.Random(seed))
+            self.assertEqual(res.number_of_edges(), 3)
+            self.assertEqual(dict(graph.degree()), dict(res.degree()))
+
+
+@ut.skipIf(ESU_find_motifs.numba is None, "numba is not installed")
+class PythonRandomizeGraphTests(RandomizeGraphTests):
+    """Run the same tests on the edge swaps used without numba."""
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(ESU_find_motifs, "numba", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+def _rand_motif_hits_with_vf2(*args, _rand_motif_hits=
+                              ESU_find_motifs._rand_motif_hits):
+    # Label the randomized networks with VF2 in the joblib workers as well
+    with mock.patch.object(ESU_find_motifs, "pynauty", None), \
+            mock.patch.object(ESU_find_motifs, "_MAX_PERMUTED_SIZE", 2):
+        return _rand_motif_hits(*args)
+
+
+class FindMotifsTests(ut.TestCase):
+    def setUp(self):
+        self.graph = nx.gnm_random_graph(30, 80, seed=1, directed=True)
+
+    def motifs(self, **kwargs):
+        return [(sorted(topo.edges()), n, p)
+                for topo, n, p in find_motifs(self.graph, rand_networks=6,
+                                              prng=random.Random(1),
+                                              **kwargs)]
+
+    def test_sampled_counts(self):
+        probabilities = (1, 0.5, 0.8)
+        sample = enumerate_subgraphs(self.graph, size=3,
+                                     probabilities=probabilities,
+                                     prng=random.Random(1))
+        counts = count_unique_topologies(self.graph.subgraph(sub)
+                                         for sub in sample)
+        # Counts are scaled by 1 / (0.5 * 0.8) before applying
+        # min_occurrences
+        expected = sorted(n * 2.5 for topo, n in counts if n * 2.5 >= 15)
+        res = find_motifs(self.graph, min_occurrences=15, rand_networks=1,
+                          prng=random.Random(1), probabilities=probabilities)
+        self.assertEqual(sorted(n for topo, n, p in res), expected)
+
+    def test_wrong_probabilities(self):
+        with self.assertRaises(ValueError):
+            find_motifs(self.graph, probabilities=(1, 0), size=2)
+
+    @ut.skipIf(ESU_find_motifs.joblib is None, "joblib is not installed")
+    def test_n_jobs(self):
+        self.assertEqual(self.motifs(n_jobs=2), self.motifs(n_jobs=1))
+
+    @ut.skipIf(ESU_find_motifs.joblib is None, "joblib is not installed")
+    def test_n_jobs_with_vf2(self):
+        with mock.patch.object(ESU_find_motifs, "pynauty", None), \
+                mock.patch.object(ESU_find_motifs, "_MAX_PERMUTED_SIZE", 2), \
+                mock.patch.object(ESU_find_motifs, "_rand_motif_hits",
+                                  _rand_motif_hits_with_vf2):
+            ESU_find_motifs._edges_label.cache_clear()
+            serial = self.motifs(size=4, n_jobs=1)
+            self.assertEqual(self.motifs(size=4, n_jobs=2), serial)
+        ESU_find_motifs._edges_label.cache_clear()
 
 
 if __name__ == '__main__':